@@ -1,103 +1,187 @@
 import azure.functions as func
-import json
+import hashlib
 import logging
 import os
-from openai import OpenAI
+import re
+import traceback
+from collections import OrderedDict
+from types import MappingProxyType
+import httpx
+import orjson
+from openai import AsyncOpenAI
 
 # OpenAI API 키 (환경변수에서 가져오기)
 API_KEY = os.getenv("OPENAI_API_KEY")
 
+# 사용할 OpenAI 모델
+MODEL = "gpt-5-nano"
+
+# 요청 크기 제한
+_MAX_BODY_BYTES = 512_000
+_MAX_LINE_LENGTH = 2000
+
+# 언어 이름 매핑
+_LANGUAGE_MAP = MappingProxyType({
+    'English': 'English',
+    'Korean': 'Korean',
+    'Japanese': 'Japanese',
+    'Chinese (Simplified)': 'Simplified Chinese',
+    'Chinese (Traditional)': 'Traditional Chinese',
+    'Spanish': 'Spanish',
+    'French': 'French',
+    'German': 'German',
+    'Portuguese': 'Portuguese',
+    'Russian': 'Russian',
+    'Italian': 'Italian',
+    'Arabic': 'Arabic',
+    'Hindi': 'Hindi',
+    'Vietnamese': 'Vietnamese',
+    'Thai': 'Thai'
+})
+
+# 빈 줄 또는 괄호/구두점만 있는 줄 (API 호출 없이 고정 설명 반환)
+_TRIVIAL_LINE_RE = re.compile(r'^\s*[\}\)\]\{\(\[;,]*\s*$')
+_TRIVIAL_EXPLANATIONS = MappingProxyType({
+    'English': 'Blank line or punctuation only.',
+    'Korean': '빈 줄 또는 괄호/구두점만 있는 줄입니다.',
+    'Japanese': '空行、または括弧・記号のみの行です。',
+    'Chinese (Simplified)': '空行或仅包含括号/标点的行。',
+    'Chinese (Traditional)': '空行或僅包含括號/標點的行。',
+    'Spanish': 'Línea en blanco o solo signos de puntuación.',
+    'French': 'Ligne vide ou uniquement de la ponctuation.',
+    'German': 'Leerzeile oder nur Satzzeichen.',
+    'Portuguese': 'Linha em branco ou apenas pontuação.',
+    'Russian': 'Пустая строка или только знаки препинания.',
+    'Italian': 'Riga vuota o solo punteggiatura.',
+    'Arabic': 'سطر فارغ أو علامات ترقيم فقط.',
+    'Hindi': 'खाली पंक्ति या केवल विराम चिह्न।',
+    'Vietnamese': 'Dòng trống hoặc chỉ có dấu câu.',
+    'Thai': 'บรรทัดว่างหรือมีเพียงเครื่องหมายวรรคตอน'
+})
+
+# OpenAI 클라이언트 (모듈 로드 시 한 번만 생성하여 TCP/TLS 연결 재사용)
+_HTTPX = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=30.0),
+    # 읽기 타임아웃은 OpenAI SDK 기본값(600초) 유지: 최대 줄 수의 일괄 응답도 끝까지 받을 수 있도록
+    timeout=httpx.Timeout(600.0, connect=10.0)
+)
+_CLIENT = AsyncOpenAI(api_key=API_KEY, http_client=_HTTPX) if API_KEY else None
+
+# 줄 단위 해석 결과 캐시 (LRU)
+_CACHE_MAX_SIZE = 1024
+_CACHE = OrderedDict()
+
 app = func.FunctionApp()
 
+
+def _ok(obj, status_code=200):
+    """객체를 JSON 바이트로 직렬화하여 응답 생성"""
+    return func.HttpResponse(
+        body=orjson.dumps(obj),
+        status_code=status_code,
+        mimetype="application/json"
+    )
+
+
+def _err(message, status_code):
+    """에러 메시지를 JSON 응답으로 생성"""
+    return _ok({"error": message}, status_code)
+
+
+def _trivial_explanation(code_line, language):
+    """빈 줄/구두점만 있는 줄이면 고정 설명을, 아니면 None 반환"""
+    if _TRIVIAL_LINE_RE.match(code_line):
+        return _TRIVIAL_EXPLANATIONS.get(language, _TRIVIAL_EXPLANATIONS['English'])
+    return None
+
+
+def _cache_key(language_name, code_line):
+    """(모델, 응답 언어, 코드 줄) 기반 캐시 키"""
+    return hashlib.blake2b(f"{MODEL}|{language_name}|{code_line}".encode(), digest_size=16).hexdigest()
+
+
+def _cache_get(language_name, code_line):
+    key = _cache_key(language_name, code_line)
+    explanation = _CACHE.get(key)
+    if explanation is not None:
+        _CACHE.move_to_end(key)
+    return explanation
+
+
+def _cache_put(language_name, code_line, explanation):
+    # 비어 있지 않은 문자열 설명만 저장 (잘못된 응답이 이후 요청에 남지 않도록)
+    if not isinstance(explanation, str) or not explanation.strip():
+        return
+    key = _cache_key(language_name, code_line)
+    _CACHE[key] = explanation
+    _CACHE.move_to_end(key)
+    if len(_CACHE) > _CACHE_MAX_SIZE:
+        _CACHE.popitem(last=False)
+
+
 @app.route(route="code_ai_interpreter", auth_level=func.AuthLevel.ANONYMOUS, methods=["POST"])
-def code_ai_interpreter(req: func.HttpRequest) -> func.HttpResponse:
+async def code_ai_interpreter(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Code AI Interpreter function processed a request.')
     
     try:
         # API 키 확인
-        if not API_KEY:
-            return func.HttpResponse(
-                json.dumps({"error": "OpenAI API key is not configured"}),
-                status_code=500,
-                mimetype="application/json"
-            )
+        if _CLIENT is None:
+            return _err("OpenAI API key is not configured", 500)
         
-        # 요청 본문 파싱
+        # 너무 큰 요청은 파싱 전에 거부
         try:
-            req_body = req.get_json()
+            content_length = int(req.headers.get("Content-Length") or 0)
         except ValueError:
-            return func.HttpResponse(
-                json.dumps({"error": "Invalid JSON in request body"}),
-                status_code=400,
-                mimetype="application/json"
-            )
+            content_length = 0
+        if content_length > _MAX_BODY_BYTES:
+            return _err("Payload too large", 413)
+        
+        body = req.get_body()
+        if len(body) > _MAX_BODY_BYTES:
+            return _err("Payload too large", 413)
+        
+        # 요청 본문 파싱 (바이트에서 바로 한 번만 파싱)
+        try:
+            req_body = orjson.loads(body or b"null")
+        except orjson.JSONDecodeError:
+            return _err("Invalid JSON in request body", 400)
         
         if not req_body:
-            return func.HttpResponse(
-                json.dumps({"error": "Request body is required"}),
-                status_code=400,
-                mimetype="application/json"
-            )
+            return _err("Request body is required", 400)
         
         code_line = req_body.get('codeLine', '')
         language = req_body.get('language', 'English')
         
         if not code_line:
-            return func.HttpResponse(
-                json.dumps({"error": "codeLine parameter is required"}),
-                status_code=400,
-                mimetype="application/json"
-            )
+            return _err("codeLine parameter is required", 400)
         
-        # 언어 이름 매핑
-        language_map = {
-            'English': 'English',
-            'Korean': 'Korean',
-            'Japanese': 'Japanese',
-            'Chinese (Simplified)': 'Simplified Chinese',
-            'Chinese (Traditional)': 'Traditional Chinese',
-            'Spanish': 'Spanish',
-            'French': 'French',
-            'German': 'German',
-            'Portuguese': 'Portuguese',
-            'Russian': 'Russian',
-            'Italian': 'Italian',
-            'Arabic': 'Arabic',
-            'Hindi': 'Hindi',
-            'Vietnamese': 'Vietnamese',
-            'Thai': 'Thai'
-        }
+        # 줄 길이 제한 (문자열이 아니면 문자열로 변환)
+        code_line = str(code_line)[:_MAX_LINE_LENGTH]
         
-        language_name = language_map.get(language, 'English')
+        language_name = _LANGUAGE_MAP.get(language, 'English')
         
-        # OpenAI 클라이언트 초기화
-        client = OpenAI(api_key=API_KEY)
-        
-        # GPT API 호출
-        logging.info(f"Calling OpenAI API with code_line: {code_line}, language: {language_name}")
-        response = client.responses.create(
-            model="gpt-5-nano",
-            input=f"Explain the following code in {language_name} briefly in 1-2 sentences:\n{code_line}"
-        )
-        
-        # 응답에서 explanation 추출
-        explanation = response.output_text.strip() if response.output_text else "No explanation returned"
+        # 빈 줄/구두점만 있는 줄은 API 호출 없이 처리, 그 외에는 캐시 확인
+        explanation = _trivial_explanation(code_line, language)
+        if explanation is None:
+            explanation = _cache_get(language_name, code_line)
+        if explanation is None:
+            # GPT API 호출
+            logging.info(f"Calling OpenAI API with code_line: {code_line}, language: {language_name}")
+            response = await _CLIENT.responses.create(
+                model=MODEL,
+                input=f"Explain the following code in {language_name} briefly in 1-2 sentences:\n{code_line}"
+            )
+            
+            # 응답에서 explanation 추출
+            if response.output_text:
+                explanation = response.output_text.strip()
+                _cache_put(language_name, code_line, explanation)
+            else:
+                explanation = "No explanation returned"
         
-        return func.HttpResponse(
-            json.dumps({"explanation": explanation}),
-            status_code=200,
-            mimetype="application/json"
-        )
+        return _ok({"explanation": explanation})
         
     except Exception as e:
-        import traceback
-        logging.error(f"Error in code_ai_interpreter: {str(e)}")
-        logging.error(traceback.format_exc())
-        return func.HttpResponse(
-            json.dumps({
-                "error": str(e),
-                "traceback": traceback.format_exc()
-            }),
-            status_code=500,
-            mimetype="application/json"
-        )
+        # 트레이스백은 로그에만 남기고 클라이언트에는 에러 메시지만 반환
+        logging.error("Error in code_ai_interpreter: %s\n%s", e, traceback.format_exc())
+        return _err(str(e), 500)
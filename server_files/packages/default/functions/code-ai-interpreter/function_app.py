@@ -1,43 +1,194 @@
 import azure.functions as func
+import asyncio
+import hashlib
 import json
 import logging
 import os
-from openai import OpenAI
+import re
+import traceback
+from collections import OrderedDict
+from types import MappingProxyType
+import httpx
+import orjson
+from openai import AsyncOpenAI
 
 # OpenAI API 키 (환경변수에서 가져오기)
 API_KEY = os.getenv("OPENAI_API_KEY")
 
+# 사용할 OpenAI 모델
+MODEL = "gpt-5-nano"
+
+# 요청 크기 제한
+_MAX_BODY_BYTES = 512_000
+_MAX_LINE_LENGTH = 2000
+_MAX_LINES = 500
+
+# 언어 이름 매핑 (응답 언어)
+_LANGUAGE_MAP = MappingProxyType({
+    'English': 'English',
+    'Korean': '한국어',
+    'Japanese': '日本語',
+    'Chinese (Simplified)': '简体中文',
+    'Chinese (Traditional)': '繁體中文',
+    'Spanish': 'Español',
+    'French': 'Français',
+    'German': 'Deutsch',
+    'Portuguese': 'Português',
+    'Russian': 'Русский',
+    'Italian': 'Italiano',
+    'Arabic': 'العربية',
+    'Hindi': 'हिन्दी',
+    'Vietnamese': 'Tiếng Việt',
+    'Thai': 'ไทย'
+})
+
+# 빈 줄 또는 괄호/구두점만 있는 줄 (API 호출 없이 고정 설명 반환)
+_TRIVIAL_LINE_RE = re.compile(r'^\s*[\}\)\]\{\(\[;,]*\s*$')
+_TRIVIAL_EXPLANATIONS = MappingProxyType({
+    'English': 'Blank line or punctuation only.',
+    'Korean': '빈 줄 또는 괄호/구두점만 있는 줄입니다.',
+    'Japanese': '空行、または括弧・記号のみの行です。',
+    'Chinese (Simplified)': '空行或仅包含括号/标点的行。',
+    'Chinese (Traditional)': '空行或僅包含括號/標點的行。',
+    'Spanish': 'Línea en blanco o solo signos de puntuación.',
+    'French': 'Ligne vide ou uniquement de la ponctuation.',
+    'German': 'Leerzeile oder nur Satzzeichen.',
+    'Portuguese': 'Linha em branco ou apenas pontuação.',
+    'Russian': 'Пустая строка или только знаки препинания.',
+    'Italian': 'Riga vuota o solo punteggiatura.',
+    'Arabic': 'سطر فارغ أو علامات ترقيم فقط.',
+    'Hindi': 'खाली पंक्ति या केवल विराम चिह्न।',
+    'Vietnamese': 'Dòng trống hoặc chỉ có dấu câu.',
+    'Thai': 'บรรทัดว่างหรือมีเพียงเครื่องหมายวรรคตอน'
+})
+
+# OpenAI 클라이언트 (모듈 로드 시 한 번만 생성하여 TCP/TLS 연결 재사용)
+_HTTPX = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=30.0),
+    # 읽기 타임아웃은 OpenAI SDK 기본값(600초) 유지: 최대 줄 수의 일괄 응답도 끝까지 받을 수 있도록
+    timeout=httpx.Timeout(600.0, connect=10.0)
+)
+_CLIENT = AsyncOpenAI(api_key=API_KEY, http_client=_HTTPX) if API_KEY else None
+
+# JSON 배열 패턴 (중첩된 중괄호 포함)
+_JSON_ARRAY_RE = re.compile(r'\[[\s\S]*\]')
+
+# 줄 단위 폴백 시 동시에 보낼 최대 요청 수
+_FALLBACK_CONCURRENCY = 10
+
+# 줄 단위 해석 결과 캐시 (LRU)
+_CACHE_MAX_SIZE = 1024
+_CACHE = OrderedDict()
+
 app = func.FunctionApp()
 
+
+def _ok(obj, status_code=200):
+    """객체를 JSON 바이트로 직렬화하여 응답 생성"""
+    return func.HttpResponse(
+        body=orjson.dumps(obj),
+        status_code=status_code,
+        mimetype="application/json"
+    )
+
+
+def _err(message, status_code):
+    """에러 메시지를 JSON 응답으로 생성"""
+    return _ok({"error": message}, status_code)
+
+
+def _trivial_explanation(code_line, language):
+    """빈 줄/구두점만 있는 줄이면 고정 설명을, 아니면 None 반환"""
+    if _TRIVIAL_LINE_RE.match(code_line):
+        return _TRIVIAL_EXPLANATIONS.get(language, _TRIVIAL_EXPLANATIONS['English'])
+    return None
+
+
+def _cache_key(language_name, code_line):
+    """(모델, 응답 언어, 코드 줄) 기반 캐시 키"""
+    return hashlib.blake2b(f"{MODEL}|{language_name}|{code_line}".encode(), digest_size=16).hexdigest()
+
+
+def _cache_get(language_name, code_line):
+    key = _cache_key(language_name, code_line)
+    explanation = _CACHE.get(key)
+    if explanation is not None:
+        _CACHE.move_to_end(key)
+    return explanation
+
+
+def _cache_put(language_name, code_line, explanation):
+    # 비어 있지 않은 문자열 설명만 저장 (잘못된 응답이 이후 요청에 남지 않도록)
+    if not isinstance(explanation, str) or not explanation.strip():
+        return
+    key = _cache_key(language_name, code_line)
+    _CACHE[key] = explanation
+    _CACHE.move_to_end(key)
+    if len(_CACHE) > _CACHE_MAX_SIZE:
+        _CACHE.popitem(last=False)
+
+
+async def _explain_line(line, language_name, semaphore):
+    """한 줄을 개별 요청으로 해석 (여러 줄 모드 폴백용), 응답이 비어 있으면 None 반환"""
+    async with semaphore:
+        response = await _CLIENT.responses.create(
+            model=MODEL,
+            input=f"다음 코드를 {language_name}로 간단하게 1-2문장으로 설명해주세요. 반드시 {language_name}로만 응답해주세요:\n{line}"
+        )
+    return response.output_text.strip() if response.output_text else None
+
+
+async def _explain_groups_individually(groups, language_name, explanations_by_index):
+    """같은 줄 그룹마다 대표 줄 하나를 병렬로 개별 요청하여 해석하고, 결과를 그룹의 모든 줄에 적용"""
+    semaphore = asyncio.Semaphore(_FALLBACK_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(_explain_line(group[0][1], language_name, semaphore))
+        for group in groups
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for group, result in zip(groups, results):
+        if isinstance(result, Exception):
+            logging.error(f"Failed to explain line {group[0][0] + 1}: {str(result)}")
+            explanation = f"오류 발생: {str(result)}"
+        elif result is None:
+            explanation = "No explanation returned"
+        else:
+            explanation = result
+        for i, line in group:
+            explanations_by_index[i] = explanation
+            if result is not None and not isinstance(result, Exception):
+                _cache_put(language_name, line, explanation)
+
+
 @app.route(route="code_ai_interpreter", auth_level=func.AuthLevel.ANONYMOUS, methods=["POST"])
-def code_ai_interpreter(req: func.HttpRequest) -> func.HttpResponse:
+async def code_ai_interpreter(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Code AI Interpreter function processed a request.')
     
     try:
         # API 키 확인
-        if not API_KEY:
-            return func.HttpResponse(
-                json.dumps({"error": "OpenAI API key is not configured"}),
-                status_code=500,
-                mimetype="application/json"
-            )
+        if _CLIENT is None:
+            return _err("OpenAI API key is not configured", 500)
         
-        # 요청 본문 파싱
+        # 너무 큰 요청은 파싱 전에 거부
         try:
-            req_body = req.get_json()
+            content_length = int(req.headers.get("Content-Length") or 0)
         except ValueError:
-            return func.HttpResponse(
-                json.dumps({"error": "Invalid JSON in request body"}),
-                status_code=400,
-                mimetype="application/json"
-            )
+            content_length = 0
+        if content_length > _MAX_BODY_BYTES:
+            return _err("Payload too large", 413)
+        
+        body = req.get_body()
+        if len(body) > _MAX_BODY_BYTES:
+            return _err("Payload too large", 413)
+        
+        # 요청 본문 파싱 (바이트에서 바로 한 번만 파싱)
+        try:
+            req_body = orjson.loads(body or b"null")
+        except orjson.JSONDecodeError:
+            return _err("Invalid JSON in request body", 400)
         
         if not req_body:
-            return func.HttpResponse(
-                json.dumps({"error": "Request body is required"}),
-                status_code=400,
-                mimetype="application/json"
-            )
+            return _err("Request body is required", 400)
         
         # codeLine (단일 줄) 또는 codeLines (여러 줄) 지원
         code_line = req_body.get('codeLine', '')
@@ -47,49 +198,41 @@ def code_ai_interpreter(req: func.HttpRequest) -> func.HttpResponse:
         # codeLines가 있으면 여러 줄 모드, 없으면 단일 줄 모드
         if code_lines:
             if not isinstance(code_lines, list) or len(code_lines) == 0:
-                return func.HttpResponse(
-                    json.dumps({"error": "codeLines must be a non-empty array"}),
-                    status_code=400,
-                    mimetype="application/json"
-                )
+                return _err("codeLines must be a non-empty array", 400)
+            if len(code_lines) > _MAX_LINES:
+                return _err(f"codeLines must not exceed {_MAX_LINES} lines", 413)
         elif not code_line:
-            return func.HttpResponse(
-                json.dumps({"error": "codeLine or codeLines parameter is required"}),
-                status_code=400,
-                mimetype="application/json"
-            )
-        
-        # 언어 이름 매핑 (응답 언어)
-        language_map = {
-            'English': 'English',
-            'Korean': '한국어',
-            'Japanese': '日本語',
-            'Chinese (Simplified)': '简体中文',
-            'Chinese (Traditional)': '繁體中文',
-            'Spanish': 'Español',
-            'French': 'Français',
-            'German': 'Deutsch',
-            'Portuguese': 'Português',
-            'Russian': 'Русский',
-            'Italian': 'Italiano',
-            'Arabic': 'العربية',
-            'Hindi': 'हिन्दी',
-            'Vietnamese': 'Tiếng Việt',
-            'Thai': 'ไทย'
-        }
+            return _err("codeLine or codeLines parameter is required", 400)
         
-        language_name = language_map.get(language, 'English')
-        
-        # OpenAI 클라이언트 초기화
-        client = OpenAI(api_key=API_KEY)
+        language_name = _LANGUAGE_MAP.get(language, 'English')
         
         if code_lines:
-            # 여러 줄 모드: 파일 전체를 한 번에 해석
-            # 각 줄에 번호를 매겨서 구분
-            numbered_lines = [f"{i+1}. {line}" for i, line in enumerate(code_lines)]
-            code_text = "\n".join(numbered_lines)
+            # 줄 길이 제한 (문자열이 아닌 항목은 문자열로 변환)
+            code_lines = [str(line)[:_MAX_LINE_LENGTH] for line in code_lines]
+            
+            # 빈 줄/구두점만 있는 줄과 캐시에 있는 줄은 바로 사용하고, 나머지만 API로 해석
+            # 같은 내용의 줄은 (앞뒤 공백 무시) 한 번만 요청하고 결과를 모든 위치에 적용
+            explanations_by_index = {}
+            pending = {}
+            for i, line in enumerate(code_lines):
+                explanation = _trivial_explanation(line, language)
+                if explanation is None:
+                    explanation = _cache_get(language_name, line)
+                if explanation is not None:
+                    explanations_by_index[i] = explanation
+                else:
+                    pending.setdefault(line.strip(), []).append((i, line))
             
-            prompt = f"""다음 코드를 {language_name}로 각 줄마다 간단하게 1-2문장으로 설명해주세요. 반드시 {language_name}로만 응답해주세요.
+            groups = list(pending.values())
+            misses = [group[0] for group in groups]
+            
+            if misses:
+                # 여러 줄 모드: 캐시에 없는 고유한 줄들을 한 번에 해석
+                # 각 줄에 번호를 매겨서 구분 (요청용 번호는 1부터 다시 매김)
+                numbered_lines = [f"{n+1}. {line}" for n, (_, line) in enumerate(misses)]
+                code_text = "\n".join(numbered_lines)
+                
+                prompt = f"""다음 코드를 {language_name}로 각 줄마다 간단하게 1-2문장으로 설명해주세요. 반드시 {language_name}로만 응답해주세요.
 
 코드:
 {code_text}
@@ -106,44 +249,60 @@ def code_ai_interpreter(req: func.HttpRequest) -> func.HttpResponse:
 - JSON 배열 형식으로만 반환 (마크다운 코드 블록 없이)
 - 다른 설명이나 주석은 추가하지 마세요
 - 반드시 유효한 JSON 형식으로만 응답해주세요"""
-            
-            logging.info(f"Calling OpenAI API with {len(code_lines)} lines, language: {language_name}")
-            
-            # 최대 3번 재시도 (JSON 파싱 실패 시)
-            max_retries = 3
-            explanations = []
-            
-            for attempt in range(max_retries):
-                try:
-                    response = client.responses.create(
-                        model="gpt-5-nano",
-                        input=prompt
-                    )
-                    
-                    # 응답 파싱
-                    response_text = response.output_text.strip() if response.output_text else "[]"
-                    
-                    # JSON 배열 추출 시도 (마크다운 코드 블록이나 다른 텍스트 제거)
-                    import re
-                    # JSON 배열 패턴 찾기 (중첩된 중괄호 포함)
-                    json_match = re.search(r'\[[\s\S]*\]', response_text)
-                    if json_match:
-                        response_text = json_match.group(0)
-                    
-                    # JSON 배열 파싱 시도
-                    parsed = json.loads(response_text)
-                    if isinstance(parsed, list) and len(parsed) > 0:
-                        explanations = parsed
-                        logging.info(f"Successfully parsed JSON response with {len(explanations)} explanations")
-                        break
-                    else:
-                        raise ValueError("Response is not a valid list or is empty")
+                
+                logging.info(f"Calling OpenAI API with {len(misses)} unique uncached lines of {len(code_lines)}, language: {language_name}")
+                
+                # 최대 3번 재시도 (JSON 파싱 실패 시)
+                max_retries = 3
+                
+                for attempt in range(max_retries):
+                    try:
+                        response = await _CLIENT.responses.create(
+                            model=MODEL,
+                            input=prompt
+                        )
                         
-                except (json.JSONDecodeError, ValueError) as e:
-                    logging.warning(f"Attempt {attempt + 1}/{max_retries} failed to parse response: {str(e)}")
-                    if attempt < max_retries - 1:
-                        # 재시도 전에 프롬프트를 더 명확하게 수정
-                        prompt = f"""다음 코드를 {language_name}로 각 줄마다 간단하게 1-2문장으로 설명해주세요.
+                        # 응답 파싱
+                        response_text = response.output_text.strip() if response.output_text else "[]"
+                        
+                        # JSON 배열 추출 시도 (마크다운 코드 블록이나 다른 텍스트 제거)
+                        json_match = _JSON_ARRAY_RE.search(response_text)
+                        if json_match:
+                            response_text = json_match.group(0)
+                        
+                        # JSON 배열 파싱 시도
+                        parsed = json.loads(response_text)
+                        if isinstance(parsed, list) and len(parsed) > 0:
+                            logging.info(f"Successfully parsed JSON response with {len(parsed)} explanations")
+                            # 요청용 번호를 원래 줄 번호로 되돌리고 줄 단위로 캐시에 저장
+                            mapped = 0
+                            for item in parsed:
+                                if not isinstance(item, dict):
+                                    continue
+                                try:
+                                    line_number = int(item.get("lineNumber"))
+                                except (TypeError, ValueError):
+                                    continue
+                                explanation = item.get("explanation")
+                                if not isinstance(explanation, str) or not explanation.strip():
+                                    continue
+                                explanation = explanation.strip()
+                                if 1 <= line_number <= len(groups):
+                                    for i, line in groups[line_number - 1]:
+                                        explanations_by_index[i] = explanation
+                                        _cache_put(language_name, line, explanation)
+                                    mapped += 1
+                            if mapped == 0:
+                                raise ValueError("Response contains no explanations for the requested lines")
+                            break
+                        else:
+                            raise ValueError("Response is not a valid list or is empty")
+                            
+                    except (json.JSONDecodeError, ValueError) as e:
+                        logging.warning(f"Attempt {attempt + 1}/{max_retries} failed to parse response: {str(e)}")
+                        if attempt < max_retries - 1:
+                            # 재시도 전에 프롬프트를 더 명확하게 수정
+                            prompt = f"""다음 코드를 {language_name}로 각 줄마다 간단하게 1-2문장으로 설명해주세요.
 
 코드:
 {code_text}
@@ -155,59 +314,58 @@ def code_ai_interpreter(req: func.HttpRequest) -> func.HttpResponse:
 ]
 
 중요: JSON 배열만 반환하고, {language_name}로 설명하세요."""
-                    else:
-                        # 마지막 시도 실패 시 기본 응답 생성
-                        logging.error("All retry attempts failed, creating default explanations")
-                        explanations = [
-                            {
-                                "lineNumber": i + 1,
-                                "explanation": f"코드 줄 {i + 1} (파싱 오류로 인해 기본 메시지)"
-                            }
-                            for i in range(len(code_lines))
-                        ]
-                except Exception as e:
-                    logging.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
-                    if attempt == max_retries - 1:
-                        # 마지막 시도 실패 시 기본 응답 생성
-                        explanations = [
-                            {
-                                "lineNumber": i + 1,
-                                "explanation": f"오류 발생: {str(e)}"
-                            }
-                            for i in range(len(code_lines))
-                        ]
+                        else:
+                            logging.error("All retry attempts failed, falling back to per-line requests")
+                    except Exception as e:
+                        logging.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
+                        if attempt == max_retries - 1:
+                            # 마지막 시도 실패 시 기본 응답 생성
+                            for group in groups:
+                                for i, _ in group:
+                                    explanations_by_index[i] = f"오류 발생: {str(e)}"
+                
+                # 응답에서 빠진 줄은 줄 단위로 병렬 요청
+                leftover_groups = [group for group in groups if group[0][0] not in explanations_by_index]
+                if leftover_groups:
+                    leftover_line_count = sum(len(group) for group in leftover_groups)
+                    logging.warning(
+                        f"{leftover_line_count} lines ({len(leftover_groups)} unique) without explanation after batch request, "
+                        f"requesting them individually"
+                    )
+                    await _explain_groups_individually(leftover_groups, language_name, explanations_by_index)
             
-            return func.HttpResponse(
-                json.dumps({"explanations": explanations}),
-                status_code=200,
-                mimetype="application/json"
-            )
+            # 캐시된 결과와 새로 받은 결과를 줄 번호 순서로 합치기
+            explanations = [
+                {"lineNumber": i + 1, "explanation": explanations_by_index[i]}
+                for i in sorted(explanations_by_index)
+            ]
+            
+            return _ok({"explanations": explanations})
         else:
             # 단일 줄 모드 (기존 방식 유지)
-            logging.info(f"Calling OpenAI API with code_line: {code_line}, language: {language_name}")
-            response = client.responses.create(
-                model="gpt-5-nano",
-                input=f"다음 코드를 {language_name}로 간단하게 1-2문장으로 설명해주세요. 반드시 {language_name}로만 응답해주세요:\n{code_line}"
-            )
+            # 줄 길이 제한 (문자열이 아니면 문자열로 변환)
+            code_line = str(code_line)[:_MAX_LINE_LENGTH]
             
-            # 응답에서 explanation 추출
-            explanation = response.output_text.strip() if response.output_text else "No explanation returned"
+            explanation = _trivial_explanation(code_line, language)
+            if explanation is None:
+                explanation = _cache_get(language_name, code_line)
+            if explanation is None:
+                logging.info(f"Calling OpenAI API with code_line: {code_line}, language: {language_name}")
+                response = await _CLIENT.responses.create(
+                    model=MODEL,
+                    input=f"다음 코드를 {language_name}로 간단하게 1-2문장으로 설명해주세요. 반드시 {language_name}로만 응답해주세요:\n{code_line}"
+                )
+                
+                # 응답에서 explanation 추출
+                if response.output_text:
+                    explanation = response.output_text.strip()
+                    _cache_put(language_name, code_line, explanation)
+                else:
+                    explanation = "No explanation returned"
             
-            return func.HttpResponse(
-                json.dumps({"explanation": explanation}),
-                status_code=200,
-                mimetype="application/json"
-            )
+            return _ok({"explanation": explanation})
         
     except Exception as e:
-        import traceback
-        logging.error(f"Error in code_ai_interpreter: {str(e)}")
-        logging.error(traceback.format_exc())
-        return func.HttpResponse(
-            json.dumps({
-                "error": str(e),
-                "traceback": traceback.format_exc()
-            }),
-            status_code=500,
-            mimetype="application/json"
-        )
\ No newline at end of file
+        # 트레이스백은 로그에만 남기고 클라이언트에는 에러 메시지만 반환
+        logging.error("Error in code_ai_interpreter: %s\n%s", e, traceback.format_exc())
+        return _err(str(e), 500)
\ No newline at end of file